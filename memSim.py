@@ -1,13 +1,22 @@
 #!/usr/bin/python3
 
+import mmap
 import sys
-from collections import deque
+from array import array
+from collections import OrderedDict, deque
+from functools import partial
+from heapq import heapify, heappop, heappush
+from itertools import cycle
 from enum import Enum
 
 # Constants
 PAGE_SIZE = 256
+PAGE_SHIFT = 8  # log2(PAGE_SIZE), page arithmetic uses shifts and masks
+OFFSET_MASK = PAGE_SIZE - 1
+TLB_SIZE = 16
+OUTPUT_BUFFER_LINES = 256
+OPT_HEAP_FACTOR = 4  # OPT heap is rebuilt from resident pages past this many entries per frame
 BACKING_STORE_FILE = "BACKING_STORE.bin"
-#ADDRESS_FILE = sys.argv[1]
 
 # enum for Page Replacement Algorithms
 class page_replacement_alg(Enum):
@@ -15,70 +24,181 @@ class page_replacement_alg(Enum):
     LRU = 2
     OPT = 3
 
-def lru(page_lru_counter, page_number, page_table):
-    if not page_lru_counter:
-        return -1  # or handle the case when the list is empty
-
-    # find the least recently used page
-    least_recently_used_page = None
-    min_use_index = float('inf')
-    for i, use_index in enumerate(page_lru_counter):
-        if use_index is not None and use_index < min_use_index:
-            min_use_index = use_index
-            least_recently_used_page = i
+def lru(lru_pages):
+    # least recently used page is at the front, most recently used at the back
+    victim_page, frame_number = lru_pages.popitem(last=False)
+    return frame_number
 
-    frame_number = least_recently_used_page
-    page_lru_counter[frame_number] = page_number
+def fifo(fifo_victims):
+    # frames are filled in order and each replacement reloads the oldest one,
+    # so the oldest frame just cycles 0, 1, ..., frames - 1
+    return next(fifo_victims)
 
-    # update page table for the evicted page
-    if page_table[frame_number]["loaded"]:
-        page_table[frame_number]["loaded"] = False
+def opt(opt_heap, opt_next, pt_loaded, pt_frame):
+    # find the page that will not be used for the longest time in the future,
+    # heap entries are (-next use, page) and go stale once the page is referenced again or evicted
+    while True:
+        next_use, victim_page = heappop(opt_heap)
+        if pt_loaded[victim_page] and opt_next[victim_page] == -next_use:
+            return pt_frame[victim_page]
 
-    # update page table for the new page
-    page_table[page_number]["frame_number"] = frame_number
-    page_table[page_number]["loaded"] = True
+def simulate(addresses, pages, offsets, next_use, page_replacement_algorithm, frames, backing_mm):
+    # initialize physical memory and other data structures
+    physical_memory = bytearray(frames * PAGE_SIZE)
+    # TLB: bit p of tlb_mask is set iff page p is cached, tlb_map holds its frame number,
+    # tlb_order keeps insertion order for FIFO eviction
+    tlb_mask = 0
+    tlb_map = array('h', [-1] * 256)
+    tlb_order = deque(maxlen=TLB_SIZE)
+    # page table, one entry per page number: frame number (-1 if never loaded) and loaded bit
+    pt_frame = array('h', [-1] * 256)
+    pt_loaded = bytearray(256)
+    # reverse mapping, frame number -> page number currently held (-1 if free)
+    frame_page = array('h', [-1] * frames)
+
+    # specific for fifo
+    # round-robin victim counter over the frames
+    fifo_victims = cycle(range(frames))
 
-    return frame_number
+    # init counters
+    page_faults = 0
+    tlb_hits = 0
+    tlb_misses = 0
 
-def fifo(page_queue, page_number, frames, page_table):
-    if len(page_queue) < frames:
-        frame_number = len(page_queue)
-        page_queue.append(frame_number)
-    else:
-        frame_number = page_queue.popleft()
-        page_queue.append(frame_number)
-        # update page table for the evicted page
-        page_table[frame_number]["loaded"] = False
-    return frame_number
+    # frames are handed out in order until memory is full, then the replacement algorithm takes over
+    next_free = 0
 
-def opt(page_opt_counter, page_opt_references, page_table):
-    # find the page that will not be used for the longest time in the future
-    farthest = -1
-    victim_page = None
-    for page_number, references in enumerate(page_opt_references):
-        if not references:
-            return page_number  # if a page is never referenced in future, return it immediately
-        if references[0] > farthest:
-            farthest = references[0]
-            victim_page = page_number
+    # specific for lru
+    # resident pages in order of use, page number -> frame number
+    lru_pages = OrderedDict()
 
-    # update page table for the evicted page
-    if victim_page is not None and page_table[victim_page]["loaded"]:
-        page_table[victim_page]["loaded"] = False
+    # specific for opt
+    # next use of each resident page as of its latest reference, and a max-heap over them
+    opt_next = array('i', [-1] * 256)
+    opt_heap = []
+    opt_heap_limit = OPT_HEAP_FACTOR * frames + TLB_SIZE
 
-    return victim_page
+    # bind the replacement algorithm once, each returns the frame to reuse
+    if page_replacement_algorithm == page_replacement_alg.FIFO:
+        evict = partial(fifo, fifo_victims)
+    elif page_replacement_algorithm == page_replacement_alg.LRU:
+        evict = partial(lru, lru_pages)
+    else:
+        evict = partial(opt, opt_heap, opt_next, pt_loaded, pt_frame)
+    track_lru = page_replacement_algorithm == page_replacement_alg.LRU
+    track_opt = page_replacement_algorithm == page_replacement_alg.OPT
+
+    # pages already read from the backing store, page number -> bytes,
+    # bounded by the 256 pages of the backing store so nothing is ever dropped
+    page_cache = {}
+
+    # output lines are collected here and written out in chunks
+    out_buf = []
+    out_append = out_buf.append
+
+    # most recently matched TLB entry, checked before the TLB itself
+    prev_page = -1
+    prev_frame = -1
+
+    # bind globals and builtins used in the loop to locals, which are cheaper to look up
+    page_size = PAGE_SIZE
+    page_shift = PAGE_SHIFT
+    tlb_size = TLB_SIZE
+    buffer_lines = OUTPUT_BUFFER_LINES
+    _heappush = heappush
+    _len = len
+    _write = sys.stdout.write
 
-def load_page_from_backing_store(page_number):
-    try:
-        with open(BACKING_STORE_FILE, "rb") as backing_store:
-            backing_store.seek(page_number * PAGE_SIZE)
-            return backing_store.read(PAGE_SIZE)
-    except IOError as e:
-        print("Error loading page from backing store", e)
-        return None
+    # process addresses
+    for i in range(len(addresses)):
+        logical_address = addresses[i]
+        page_number = pages[i]
+        offset = offsets[i]
+
+        # TLB lookup
+        if page_number == prev_page:
+            frame_number = prev_frame
+            tlb_hits += 1
+        elif tlb_mask >> page_number & 1:
+            frame_number = tlb_map[page_number]
+            prev_page = page_number
+            prev_frame = frame_number
+            tlb_hits += 1
+        else:
+            tlb_misses += 1
 
-def convert_physical_address(frame_number, offset):
-    return frame_number * PAGE_SIZE + offset
+            # page table lookup
+            if pt_loaded[page_number]:
+                # soft miss, page is still resident in memory
+                frame_number = pt_frame[page_number]
+            else:
+                # page fault
+                page_faults += 1
+
+                # find a free frame or use page replacement algorithm
+                if next_free < frames:
+                    frame_number = next_free
+                    next_free += 1
+                else:
+                    frame_number = evict()
+
+                # evict the page previously held by this frame from the page table and TLB
+                evicted_page = frame_page[frame_number]
+                if evicted_page >= 0:
+                    pt_loaded[evicted_page] = 0
+                    if tlb_mask >> evicted_page & 1:
+                        tlb_mask &= ~(1 << evicted_page)
+                        tlb_order.remove(evicted_page)
+                frame_page[frame_number] = page_number
+
+                # load page from backing store after its viable, pages faulted in before are reused
+                page_data = page_cache.get(page_number)
+                if page_data is None:
+                    page_base = page_number << page_shift
+                    page_data = backing_mm[page_base:page_base + page_size]
+                    page_cache[page_number] = page_data
+                # update physical memory
+                frame_base = frame_number << page_shift
+                physical_memory[frame_base:frame_base + page_size] = page_data
+                pt_frame[page_number] = frame_number
+                pt_loaded[page_number] = 1
+
+            # update TLB
+            # the deque is bounded, appending to a full TLB drops its oldest entry
+            if _len(tlb_order) == tlb_size:
+                tlb_mask &= ~(1 << tlb_order[0])
+            tlb_order.append(page_number)
+            tlb_mask |= 1 << page_number
+            tlb_map[page_number] = frame_number
+            prev_page = page_number
+            prev_frame = frame_number
+
+        if track_lru:
+            lru_pages[page_number] = frame_number
+            lru_pages.move_to_end(page_number)
+        elif track_opt:
+            opt_next[page_number] = next_use[i]
+            _heappush(opt_heap, (-next_use[i], page_number))
+            if _len(opt_heap) > opt_heap_limit:
+                # drop stale entries, keeping one current entry per resident page
+                opt_heap[:] = [(-opt_next[page], page) for page in frame_page if page >= 0]
+                heapify(opt_heap)
+
+        # calculate physical address and retrieve value
+        frame_base = frame_number << page_shift
+        value = physical_memory[frame_base | offset]
+
+        # print output using proper byte format
+        frame_content = physical_memory[frame_base:frame_base + page_size].hex()
+        out_append(f"{logical_address},{value},{frame_number},{frame_content}\n")
+        out_append(f"{logical_address},{value},{frame_number}\n")
+        if _len(out_buf) >= buffer_lines:
+            _write("".join(out_buf))
+            out_buf.clear()
+
+    _write("".join(out_buf))
+
+    return page_faults, tlb_hits, tlb_misses
 
 def main():
     # set default values
@@ -102,116 +222,48 @@ def main():
     if (len(sys.argv) >= 4):
         PRA = sys.argv[3].upper()
 
-    PHYSICAL_MEMORY_SIZE = 256 * FRAMES
-
-
-    # initialize physical memory and other data structures
-    physical_memory = [None] * PHYSICAL_MEMORY_SIZE
-    tlb = []
-    page_table = [{"frame_number": -1, "loaded": False} for _ in range(256)]
-
-    # initialize page queue for FIFO
-    page_queue = deque(maxlen=FRAMES)
+    # read the reference sequence once, then split into page numbers and offsets
+    with open(ADDRESS_FILE, "r") as address_file:
+        addresses = array('q', map(int, address_file.read().split()))
+    # mask 16 rightmost bits / divide
+    pages = bytes((logical_address >> PAGE_SHIFT) & 0xFF for logical_address in addresses)
+    offsets = bytes(logical_address & OFFSET_MASK for logical_address in addresses)
+    total_addresses = len(addresses)
 
     # init page replacement algorithm
+    next_use = None
     if PRA == "FIFO":
         page_replacement_algorithm = page_replacement_alg.FIFO
     elif PRA == "LRU":
         page_replacement_algorithm = page_replacement_alg.LRU
     elif PRA == "OPT":
         page_replacement_algorithm = page_replacement_alg.OPT
-        page_opt_counter = [0] * FRAMES
-        page_opt_references = [[] for _ in range(256)]
-        with open(ADDRESS_FILE, "r") as address_file:
-            for i, line in enumerate(address_file):
-                logical_address = int(line.strip())
-                page_number = (logical_address >> 8) & 0xFF
-                page_opt_references[page_number].append(i)
+        # next_use[i] is the index of the next reference to the same page as reference i,
+        # total_addresses if it is never referenced again
+        next_use = array('i', [total_addresses]) * total_addresses
+        last_use = [total_addresses] * 256
+        for i in range(total_addresses - 1, -1, -1):
+            page_number = pages[i]
+            next_use[i] = last_use[page_number]
+            last_use[page_number] = i
     else:
         print("Invalid page replacement algorithm. Choose from 'fifo', 'lru', or 'opt'.")
         return
 
-    # init counters
-    page_faults = 0
-    tlb_hits = 0
-    tlb_misses = 0
-    total_addresses = 0
-
-    # specific for lru/opt
-    page_lru_counter = {}
-    page_opt_counter = []
+    # map the backing store once, pages are sliced out of it on each fault
+    try:
+        backing_store = open(BACKING_STORE_FILE, "rb")
+    except IOError as e:
+        print("Error opening backing store", e)
+        return
+    backing_mm = mmap.mmap(backing_store.fileno(), 0, access=mmap.ACCESS_READ)
 
     # process addresses
-    with open(ADDRESS_FILE, "r") as address_file:
-        for line in address_file:
-            total_addresses += 1
-
-            logical_address = int(line.strip())
-            # mask 16 rightmost bits / divide
-            page_number = (logical_address >> 8) & 0xFF
-            offset = logical_address & 0xFF
-
-            # TLB lookup
-            tlb_hit = False
-            for entry in tlb:
-                if entry["page_number"] == page_number:
-                    tlb_hit = True
-                    frame_number = entry["frame_number"]
-                    break
-
-            if tlb_hit:
-                #print(f"HIT on address {logical_address} on frame {frame_number}")
-                tlb_hits += 1
-            else:
-                tlb_misses += 1
-                #print(f"MISS on address {logical_address}")
-
-                # page table lookup
-                frame_number = -1
-                for entry in page_table:
-                    if entry["frame_number"] == page_number:
-                        print("nOT USELESS")
-                        frame_number = entry["frame_number"]
-                        if not entry["loaded"]:
-                            page_faults += 1
-                        break
-
-                if frame_number == -1:
-                    # page fault or soft miss
-                    page_faults += 1
-
-                    # find a free frame or use page replacement algorithm
-                    if len(page_queue) < FRAMES:
-                        frame_number = len(page_queue)
-                        page_queue.append(frame_number)
-                    elif page_replacement_algorithm == page_replacement_alg.FIFO:
-                        frame_number = fifo(page_queue, page_number, FRAMES, page_table)
-                    elif page_replacement_algorithm == page_replacement_alg.LRU:
-                        frame_number = lru(page_lru_counter, page_number, page_table)
-                    elif page_replacement_algorithm == page_replacement_alg.OPT:
-                        frame_number = opt(page_opt_counter, page_opt_references, page_table)
-
-                    # load page from backing store after its viable
-                    page_data = load_page_from_backing_store(page_number)
-                    # update physical memory
-                    physical_memory[frame_number * PAGE_SIZE:(frame_number + 1) * PAGE_SIZE] = page_data
-                    page_table[page_number]["frame_number"] = frame_number
-                    page_table[page_number]["loaded"] = True
-
-                    # update TLB
-                    tlb_entry = {"page_number": page_number, "frame_number": frame_number}
-                    tlb.append(tlb_entry)
-                    if len(tlb) > 16:
-                        tlb.pop(0)
-
-            # calculate physical address and retrieve value
-            physical_address = convert_physical_address(frame_number, offset)
-            value = physical_memory[physical_address]
-
-            # print output using proper byte format
-            frame_content = "".join("{:02x}".format(byte) for byte in physical_memory[frame_number * PAGE_SIZE:(frame_number + 1) * PAGE_SIZE])
-            print(f"{logical_address},{value},{frame_number},{frame_content}")
-            print(f"{logical_address},{value},{frame_number}")
+    page_faults, tlb_hits, tlb_misses = simulate(addresses, pages, offsets, next_use,
+                                                 page_replacement_algorithm, FRAMES, backing_mm)
+
+    backing_mm.close()
+    backing_store.close()
 
     # calculate statistics
     page_fault_rate = page_faults / total_addresses * 100 if total_addresses > 0 else 0